@@ -0,0 +1,36 @@
+import numpy as np
+from SystemOfUnits import *
+
+class FieldMap():
+    """
+    B and E field profiles along the beam axis of the spectrometer.
+    The field map file is a whitespace separated text file with three columns:
+    z (cm), B (T), E (kV/cm)
+    z is measured from the entrance of the magnet, lines starting with # are ignored.
+    Outside the tabulated range both fields are zero.
+    """
+
+    def __init__(self, fname):
+        """fname: file name of the field map"""
+        self.fname = fname
+        data = np.loadtxt(fname, ndmin=2)
+        order = np.argsort(data[:, 0], kind='stable') # keep the order of steps at the same z
+        self.z = data[order, 0] * cm        # position along the beam axis
+        self.B = data[order, 1] * T         # magnetic field in unit of Tesla
+        self.E = data[order, 2] * kV/cm     # electric field in unit of V/m
+        # integrated trajectories, energy->(x, y) tables keyed by ion and screen position
+        self._cache = dict()
+
+    def getField(self, z):
+        """return the B and E field at position z"""
+        B = np.interp(z, self.z, self.B, left=0, right=0)
+        E = np.interp(z, self.z, self.E, left=0, right=0)
+        return B, E
+
+    def getTable(self, key):
+        """return a previously integrated energy->(x, y) table, None if there is none"""
+        return self._cache.get(key)
+
+    def setTable(self, key, table):
+        """store an integrated energy->(x, y) table"""
+        self._cache[key] = table
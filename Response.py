@@ -0,0 +1,100 @@
+import numpy as np
+from SystemOfUnits import *
+
+# fading parameters (A1, B1, A2, B2) of the detectors, B in minutes, MCP does not fade
+# f(t) = A1*exp(-t/B1) + A2*exp(-t/B2), Boutoux et al. Rev. Sci. Instrum. 86, 113304 (2015)
+FADING = {'TR': (0.535, 23.812, 0.465, 3837.2),
+          'SR': (0.579, 15.052, 0.421, 3829.5),
+          'MS': (0.334, 107.32, 0.666, 33974),
+          'MCP': (1, np.inf, 0, np.inf)}
+
+def solidAngle(diameter, distance):
+    """
+    solid angle of the pinhole in sr
+    diameter: pinhole diameter in mm
+    distance: distance between the source and the pinhole in cm
+    """
+    return pi*(diameter*mm/2)**2/(distance*cm)**2
+
+class DetectorResponse():
+    """
+    Energy dependent response of the detector (image plate or MCP)
+    Convert the signal (PSL/MeV) into particle number (particles/MeV/sr)
+    The response file is a whitespace separated text file, the first line holds
+    the column names: Energy H1 C12 ..., followed by the energy (MeV) and the
+    signal per particle (PSL) of each species at that energy.
+    """
+
+    def __init__(self, fname, pinhole=0.3, distance=50, detector='TR'):
+        """
+        fname: file name of the response table
+        pinhole: pinhole diameter in mm
+        distance: distance between the source and the pinhole in cm
+        detector: detector type, one of the keys of FADING
+        """
+        self.fname = fname
+        with open(fname, 'r') as f:
+            header = f.readline().lstrip('#').split()
+        try:
+            float(header[0]) # a numeric first field means the header line is missing
+        except ValueError:
+            pass
+        except IndexError:
+            raise ValueError('response table has no header line: Energy H1 C12 ...')
+        else:
+            raise ValueError('response table has no header line: Energy H1 C12 ...')
+        self.species = header[1:]
+        if len(set(self.species)) != len(self.species):
+            raise ValueError('species names in the response table are not unique')
+        data = np.loadtxt(fname, skiprows=1, ndmin=2)
+        if len(self.species) != data.shape[1] - 1:
+            raise ValueError('response table has {} species names but {} response columns'
+                             .format(len(self.species), data.shape[1] - 1))
+        order = np.argsort(data[:, 0])
+        self.energy = data[order, 0]        # energy in MeV
+        if len(self.energy) < 2 or np.any(np.diff(self.energy) == 0):
+            raise ValueError('response table needs at least two energies, all different')
+        self.response = data[order, 1:].T   # response of each species, PSL per particle
+        if np.any(~(self.response > 0)):
+            raise ValueError('response table has zero, negative or missing values')
+        self.pinhole = pinhole
+        self.distance = distance
+        self.detector = detector
+
+    def getSolidAngle(self):
+        """solid angle of the pinhole in sr"""
+        return solidAngle(self.pinhole, self.distance)
+
+    def getResponse(self, species, energy):
+        """
+        interpolate the response of the species on the given energy grid
+        species: a species name, or a sequence of names along the second last axis of energy
+        values outside the tabulated range are held at the boundary values
+        """
+        rows = np.expand_dims([self.species.index(s) for s in np.atleast_1d(species)], -1)
+        if isinstance(species, str):
+            rows = rows[0]
+        energy = np.asarray(energy)
+        # all species share the same energy column, so the interpolation weights are computed once
+        i = np.clip(np.searchsorted(self.energy, energy), 1, len(self.energy) - 1)
+        w = np.clip((energy - self.energy[i-1])/(self.energy[i] - self.energy[i-1]), 0, 1)
+        return self.response[rows, i-1]*(1 - w) + self.response[rows, i]*w
+
+    def getFading(self, t):
+        """fraction of the signal left after t minutes between exposure and scan"""
+        A1, B1, A2, B2 = FADING[self.detector]
+        t = np.asarray(t, dtype=float)
+        return (A1*np.exp(-t/B1) + A2*np.exp(-t/B2))/(A1 + A2)
+
+    def correct(self, species, energy, dNdE, fading_time=0):
+        """
+        convert dN/dE (PSL/MeV) into particles/MeV/sr
+        energy and dNdE: arrays of shape (..., n_energy), e.g. (shots, species, n_energy)
+        species: a species name, or a sequence of names along the second last axis
+        fading_time: time between exposure and scan in minutes, scalar or
+                     an array along the leading (shot) axis
+        """
+        dNdE = np.asarray(dNdE)
+        f = self.getFading(fading_time)
+        f = f.reshape(f.shape + (1,)*(dNdE.ndim - f.ndim))
+        return dNdE/(self.getResponse(species, energy)*f*self.getSolidAngle())
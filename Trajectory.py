@@ -10,7 +10,8 @@ class Trajectory():
     Draw Trajectory on the image
     """
 
-    def __init__(self, q=1, m=2.014, B=0.44, E=20, L_M=10, L_ME=8, L_E=40, L_ES=8, scale=40):
+    def __init__(self, q=1, m=2.014, B=0.44, E=20, L_M=10, L_ME=8, L_E=40, L_ES=8, scale=40,
+                 field_map=None):
         self.q = q * e        # charge of the ion
         self.m = m * u        # AUM mass of the ion
         self.B = B * T        # magnetic field in unit of Tesla
@@ -20,12 +21,14 @@ class Trajectory():
         self.L_E = L_E * cm   # length of the electrode
         self.L_ES = L_ES * cm # length between the electrode and screen
         self.scale = scale    # image scale
+        self.field_map = field_map # FieldMap object, use the hard-edge uniform field model if None
         self.calculate()
 
     def calculate(self, energy_min=None, energy_max=None):
         """
         Calculate the trajectory
         Return the corespponding energy and x, y positon
+        If a field map is given, the trajectory is integrated numerically through it
         """
 
         if energy_min == None:
@@ -36,6 +39,9 @@ class Trajectory():
             energy_max = self.q*80e6
 
         self.E_k = np.geomspace(energy_min, energy_max, 200) # kinetic energy of the ions
+        if self.field_map is not None:
+            self.x0, self.y0 = self.integrate()
+            return
         E_m = self.m*c**2                                    # mass energy
         E_t = self.E_k + E_m                                 # total relativistic energy of the ions
         p = sqrt(E_t**2-E_m**2)/c                            # relativistic momentum
@@ -46,6 +52,55 @@ class Trajectory():
         self.y0 = (self.q*self.E*(self.L_ES+self.L_E)*self.L_E
                 / (p**2*(1-(self.L_M/r)**2)) * gamma * self.m)
 
+    def integrate(self, step=0.5*mm):
+        """
+        Integrate the relativistic equations of motion through the field map
+        for all energies at once with a 4th order Runge-Kutta method, using z as the
+        independent variable. B deflects the ions along x and E along y.
+        The result is cached in the field map, so it is only computed once per ion.
+        Return the x, y position on the screen
+        """
+        z_screen = self.L_M + self.L_ME + self.L_E + self.L_ES
+        key = (self.q, self.m, z_screen, self.E_k[0], self.E_k[-1], len(self.E_k), step)
+        table = self.field_map.getTable(key)
+        if table is not None:
+            return table
+
+        E_m = self.m*c**2
+        p0 = sqrt((self.E_k + E_m)**2 - E_m**2)/c
+        # state of all ions: x, y, px, py, pz
+        state = np.zeros((5, len(self.E_k)))
+        state[4] = p0
+
+        def derivative(z, s):
+            B, E = self.field_map.getField(z)
+            x, y, px, py, pz = s
+            gm = sqrt(self.m**2 + (px**2 + py**2 + pz**2)/c**2) # gamma * m
+            return np.array([px/pz,
+                             py/pz,
+                             self.q*B*np.ones_like(pz),
+                             self.q*E*gm/pz,
+                             -self.q*B*px/pz])
+
+        z_start = min(0, self.field_map.z[0])
+        n_step = int(np.ceil((z_screen - z_start)/step))
+        h = (z_screen - z_start)/n_step
+        z = z_start
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i in range(n_step):
+                k1 = derivative(z, state)
+                k2 = derivative(z + h/2, state + h/2*k1)
+                k3 = derivative(z + h/2, state + h/2*k2)
+                k4 = derivative(z + h, state + h*k3)
+                state = state + h/6*(k1 + 2*k2 + 2*k3 + k4)
+                z += h
+                # ions which are turned back by the magnet never reach the screen
+                state[:, ~(state[4] > 0)] = np.nan
+
+        table = (state[0], state[1])
+        self.field_map.setTable(key, table)
+        return table
+
     def transform(self, dx=0, dy=0, rotate=0):
         """
         dx, dy are the position of zero point of image
@@ -96,11 +151,43 @@ class Trajectory():
             self.dNdE[i-1] = np.trapz(fspec(inte_x), inte_x)
         # set the middle value of the energy_range as the new energy value()
         self.energy = (energy_range[:-1] + energy_range[1:])/2
+        # the absolute calibration belongs to the previous spectrum
+        self.dNdO = None
+        self.calibration = None
         return self.energy, self.dNdE
 
+    def calibrate(self, response, species, fading_time=0):
+        """
+        convert the extracted spectrum into particles/MeV/sr
+        response is a DetectorResponse object, species is the name in its response table
+        fading_time is the time between exposure and scan in minutes
+        """
+        self.dNdO = response.correct(species, self.energy, self.dNdE, fading_time)
+        # settings of the calibration, saved along with the spectrum
+        self.calibration = [('Species', species),
+                            ('Response', response.fname),
+                            ('Detector', response.detector),
+                            ('Pinhole (mm)', response.pinhole),
+                            ('Distance (cm)', response.distance),
+                            ('Solid angle (sr)', response.getSolidAngle()),
+                            ('Fading (min)', fading_time)]
+        return self.energy, self.dNdO
+
+    def clearCalibration(self):
+        """go back to the spectrum in PSL/MeV"""
+        self.dNdO = None
+        self.calibration = None
+
     def saveSpectrum(self, filename):
         """save the sepctrum to a file"""
         with open(filename, 'w') as f:
-            f.write('Energy(MeV), dN/dE(PSL/MeV)\n')
-            for e, n in zip(self.energy, self.dNdE):
-                f.write('{}, {}\n'.format(e, n))
+            if getattr(self, 'dNdO', None) is None:
+                f.write('Energy(MeV), dN/dE(PSL/MeV)\n')
+                for e, n in zip(self.energy, self.dNdE):
+                    f.write('{}, {}\n'.format(e, n))
+            else:
+                for name, value in self.calibration:
+                    f.write('# {} : {}\n'.format(name, value))
+                f.write('Energy(MeV), dN/dE(PSL/MeV), dN/dE/dOmega(particles/MeV/sr)\n')
+                for e, n, o in zip(self.energy, self.dNdE, self.dNdO):
+                    f.write('{}, {}, {}\n'.format(e, n, o))
@@ -7,6 +7,8 @@ import matplotlib.ticker as ticker
 import ElementTable
 from Trajectory import *
 from SPEFile import *
+from FieldMap import *
+from Response import *
 import pdb
 
 class Window(QtWidgets.QMainWindow):
@@ -70,6 +72,22 @@ class Window(QtWidgets.QMainWindow):
         self.save_spec_action.setStatusTip('Save Spectrum as a CSV file')
         self.save_spec_action.triggered.connect(self.saveSpec)
 
+        self.load_field_action = QtWidgets.QAction('Load Field Map', self)
+        self.load_field_action.setStatusTip('Load B and E field profiles for numerical trajectory calculation')
+        self.load_field_action.triggered.connect(self.loadFieldMap)
+
+        self.clear_field_action = QtWidgets.QAction('Clear Field Map', self)
+        self.clear_field_action.setStatusTip('Use the uniform field model for trajectory calculation')
+        self.clear_field_action.triggered.connect(self.clearFieldMap)
+
+        self.load_response_action = QtWidgets.QAction('Load Detector Response', self)
+        self.load_response_action.setStatusTip('Load detector response table for absolute calibration')
+        self.load_response_action.triggered.connect(self.loadResponse)
+
+        self.clear_response_action = QtWidgets.QAction('Clear Detector Response', self)
+        self.clear_response_action.setStatusTip('Show the spectrum in PSL/MeV')
+        self.clear_response_action.triggered.connect(self.clearResponse)
+
         self.exit_action = QtWidgets.QAction('Exit', self)
         self.exit_action.setShortcut('Ctrl+Q')
         self.exit_action.setStatusTip('Exit application')
@@ -79,6 +97,10 @@ class Window(QtWidgets.QMainWindow):
         self.file_menu.addAction(self.save_param_action)
         self.file_menu.addAction(self.load_param_action)
         self.file_menu.addAction(self.save_spec_action)
+        self.file_menu.addAction(self.load_field_action)
+        self.file_menu.addAction(self.clear_field_action)
+        self.file_menu.addAction(self.load_response_action)
+        self.file_menu.addAction(self.clear_response_action)
         self.file_menu.addAction(self.exit_action)
 
         self.help_action = QtWidgets.QAction('How to use', self)
@@ -133,6 +155,26 @@ class Window(QtWidgets.QMainWindow):
         self.L_ES_label.setObjectName("L_ES_label")
         self.detector_group_layout.addWidget(self.L_ES_label, 5, 0, 1, 1)
 
+        self.detector_type_label = QtWidgets.QLabel("Detector :", self.detector_group)
+        self.detector_type_label.setFocusPolicy(QtCore.Qt.NoFocus)
+        self.detector_type_label.setObjectName("detector_type_label")
+        self.detector_group_layout.addWidget(self.detector_type_label, 6, 0, 1, 1)
+
+        self.pinhole_label = QtWidgets.QLabel("Pinhole (mm) :", self.detector_group)
+        self.pinhole_label.setFocusPolicy(QtCore.Qt.NoFocus)
+        self.pinhole_label.setObjectName("pinhole_label")
+        self.detector_group_layout.addWidget(self.pinhole_label, 7, 0, 1, 1)
+
+        self.distance_label = QtWidgets.QLabel("Distance (cm) :", self.detector_group)
+        self.distance_label.setFocusPolicy(QtCore.Qt.NoFocus)
+        self.distance_label.setObjectName("distance_label")
+        self.detector_group_layout.addWidget(self.distance_label, 8, 0, 1, 1)
+
+        self.fading_label = QtWidgets.QLabel("Fading (min) :", self.detector_group)
+        self.fading_label.setFocusPolicy(QtCore.Qt.NoFocus)
+        self.fading_label.setObjectName("fading_label")
+        self.detector_group_layout.addWidget(self.fading_label, 9, 0, 1, 1)
+
         self.B_box = QtWidgets.QDoubleSpinBox(self.detector_group)
         self.B_box.setButtonSymbols(QtWidgets.QAbstractSpinBox.NoButtons)
         self.B_box.setObjectName("B_box")
@@ -171,6 +213,38 @@ class Window(QtWidgets.QMainWindow):
         self.L_ES_box.setValue(7)
         self.detector_group_layout.addWidget(self.L_ES_box, 5, 1, 1, 1)
 
+        self.detector_type_box = QtWidgets.QComboBox(self.detector_group)
+        self.detector_type_box.setObjectName("detector_type_box")
+        self.detector_type_box.addItems(list(FADING))
+        self.detector_group_layout.addWidget(self.detector_type_box, 6, 1, 1, 1)
+
+        self.pinhole_box = QtWidgets.QDoubleSpinBox(self.detector_group)
+        self.pinhole_box.setButtonSymbols(QtWidgets.QAbstractSpinBox.NoButtons)
+        self.pinhole_box.setObjectName("pinhole_box")
+        self.pinhole_box.setDecimals(2)
+        self.pinhole_box.setMinimum(0.01)
+        self.pinhole_box.setMaximum(10)
+        self.pinhole_box.setValue(0.3)
+        self.detector_group_layout.addWidget(self.pinhole_box, 7, 1, 1, 1)
+
+        self.distance_box = QtWidgets.QDoubleSpinBox(self.detector_group)
+        self.distance_box.setButtonSymbols(QtWidgets.QAbstractSpinBox.NoButtons)
+        self.distance_box.setObjectName("distance_box")
+        self.distance_box.setDecimals(1)
+        self.distance_box.setMinimum(1)
+        self.distance_box.setMaximum(1000)
+        self.distance_box.setValue(50)
+        self.detector_group_layout.addWidget(self.distance_box, 8, 1, 1, 1)
+
+        self.fading_box = QtWidgets.QDoubleSpinBox(self.detector_group)
+        self.fading_box.setButtonSymbols(QtWidgets.QAbstractSpinBox.NoButtons)
+        self.fading_box.setObjectName("fading_box")
+        self.fading_box.setDecimals(1)
+        self.fading_box.setMinimum(0)
+        self.fading_box.setMaximum(100000)
+        self.fading_box.setValue(0)
+        self.detector_group_layout.addWidget(self.fading_box, 9, 1, 1, 1)
+
         for box in [self.E_box, self.L_M_box, self.L_ME_box, self.L_E_box, self.L_ES_box]:
             box.setMinimum(0)
             box.setMaximum(50)
@@ -364,6 +438,14 @@ class Window(QtWidgets.QMainWindow):
             f.write("Tilt : {}\n".format(self.tilt_box.value()))
             f.write("Scale : {}\n".format(self.scale_box.value()))
 
+            f.write("Detector : {}\n".format(self.detector_type_box.currentText()))
+            f.write("Pinhole (mm) : {}\n".format(self.pinhole_box.value()))
+            f.write("Distance (cm) : {}\n".format(self.distance_box.value()))
+            f.write("Fading (min) : {}\n".format(self.fading_box.value()))
+
+            field_map = getattr(self, 'field_map', None)
+            f.write("FieldMap : {}\n".format(field_map.fname if field_map is not None else None))
+
     def loadParam(self):
         """"load parameter from a previously saved file"""
         filename, _ = QtWidgets.QFileDialog.getOpenFileName(self,
@@ -380,15 +462,81 @@ class Window(QtWidgets.QMainWindow):
                     # check if its the item that we are looking for
                     assert line[0] == name
                     box.setValue(float(line[-1]))
+                # optional entries, older parameter files end here
+                for line in f:
+                    name, value = line.rstrip('\n').split(' : ', 1)
+                    if name == 'Detector':
+                        assert value in FADING
+                        self.detector_type_box.setCurrentText(value)
+                    elif name == 'Pinhole (mm)':
+                        self.pinhole_box.setValue(float(value))
+                    elif name == 'Distance (cm)':
+                        self.distance_box.setValue(float(value))
+                    elif name == 'Fading (min)':
+                        self.fading_box.setValue(float(value))
+                    elif name == 'FieldMap':
+                        if value == 'None':
+                            self.clearFieldMap()
+                        else:
+                            self.setFieldMap(value)
         except:
             QtWidgets.QMessageBox.about(self, "Warning", "Corrupted parameter file!")
 
+    def loadFieldMap(self):
+        """load B and E field profiles along the beam axis from a text file"""
+        filename, _ = QtWidgets.QFileDialog.getOpenFileName(self,
+                        "Open Field Map", "","Text Files (*.txt);;All Files (*)")
+        if not filename:
+            return
+        try:
+            self.setFieldMap(filename)
+        except:
+            QtWidgets.QMessageBox.about(self, "Warning", "Corrupted field map file!")
+
+    def setFieldMap(self, filename):
+        """use the field map in filename, the B and E field boxes are ignored meanwhile"""
+        self.field_map = FieldMap(filename)
+        for box in [self.B_box, self.E_box]:
+            box.setEnabled(False)
+            box.setToolTip("Given by the field map")
+        self.statusBar().showMessage('Field map: ' + filename)
+
+    def clearFieldMap(self):
+        """go back to the uniform field model"""
+        self.field_map = None
+        for box in [self.B_box, self.E_box]:
+            box.setEnabled(True)
+            box.setToolTip("")
+        self.statusBar().showMessage('Field map cleared, using uniform field model')
+
+    def loadResponse(self):
+        """load the detector response table for absolute calibration"""
+        filename, _ = QtWidgets.QFileDialog.getOpenFileName(self,
+                        "Open Detector Response", "","Text Files (*.txt);;All Files (*)")
+        if not filename:
+            return
+        try:
+            self.response = DetectorResponse(filename)
+        except Exception as err:
+            QtWidgets.QMessageBox.about(self, "Warning", "Corrupted detector response file!\n{}".format(err))
+        else:
+            self.statusBar().showMessage('Detector response: ' + filename)
+
+    def clearResponse(self):
+        """show the spectrum without absolute calibration"""
+        self.response = None
+        if hasattr(self, 'trajectory'):
+            self.trajectory.clearCalibration()
+        self.statusBar().showMessage('Detector response cleared, spectrum in PSL/MeV')
+
     def saveSpec(self):
         """"save the spectrum to a CSV file"""
         filename, _ = QtWidgets.QFileDialog.getSaveFileName(self,"Save Spectrum","","CSV Files (*.csv);;All Files (*)")
         if not filename:
             return
         try:# avoid the error that a spectrum may not have been generated
+            # calibrate with the current settings, so the file matches them
+            self.calibrateSpectrum()
             self.trajectory.saveSpectrum(filename)
         except:
             QtWidgets.QMessageBox.about(self, "Warning", "No extracted spectrum found!")
@@ -401,6 +549,9 @@ class Window(QtWidgets.QMainWindow):
             if iso.A == self.isotope_box.currentText():
                 m = float(iso.mass)
                 break
+        # species name in the response table, e.g. H1, C12
+        self.species = (ElementTable.table[self.element_box.currentIndex()].name.lstrip('0123456789')
+                        + self.isotope_box.currentText())
         try:# avoid the error that some parameter maybe missing
             self.trajectory = Trajectory(q = int(self.charge_box.currentText()),
                                         m = m,
@@ -410,7 +561,8 @@ class Window(QtWidgets.QMainWindow):
                                         L_ME = self.L_ME_box.value(),
                                         L_E = self.L_E_box.value(),
                                         L_ES = self.L_ES_box.value(),
-                                        scale = self.scale_box.value())
+                                        scale = self.scale_box.value(),
+                                        field_map = getattr(self, 'field_map', None))
         except:
             QtWidgets.QMessageBox.about(self, "Warning", "Some parameters are missing")
         else:
@@ -439,17 +591,39 @@ class Window(QtWidgets.QMainWindow):
         if hasattr(self, "trajectory"):
             self.plot_axes.cla()
             E, dNdE = self.trajectory.extracSpectrum(self.img)
+            ylabel = 'Signal Level (PSL/MeV)'
+            if self.calibrateSpectrum():
+                E, dNdE = self.trajectory.energy, self.trajectory.dNdO
+                ylabel = 'Particle Number (1/MeV/sr)'
             self.plot_axes.plot(E, dNdE)
             self.plot_axes.set_xlim(left=0)
             self.plot_axes.set_ylim(bottom=0)
             self.plot_axes.set_xlabel('Ion Energy (MeV)')
-            self.plot_axes.set_ylabel('Signal Level (PSL/MeV)')
+            self.plot_axes.set_ylabel(ylabel)
             self.plot_axes.ticklabel_format(style='sci', scilimits=(-2, 3))
             self.tab_widget.setCurrentWidget(self.plot_canvas)
             self.plot_canvas.draw()
         else:
             QtWidgets.QMessageBox.about(self, "Reminder", "Please draw a trajectory first")
 
+    def calibrateSpectrum(self):
+        """
+        apply the detector response with the current settings to the extracted spectrum
+        return True if the spectrum is calibrated
+        """
+        self.trajectory.clearCalibration()
+        if getattr(self, 'response', None) is None:
+            return False
+        if self.species not in self.response.species:
+            QtWidgets.QMessageBox.about(self, "Warning",
+                "No detector response found for {}!".format(self.species))
+            return False
+        self.response.pinhole = self.pinhole_box.value()
+        self.response.distance = self.distance_box.value()
+        self.response.detector = self.detector_type_box.currentText()
+        self.trajectory.calibrate(self.response, self.species, self.fading_box.value())
+        return True
+
     def updateComboBox(self, i):
         """update the isotope and charge combobox after user made a choice for an element"""
         self.isotope_box.clear()
@@ -465,6 +639,8 @@ class Window(QtWidgets.QMainWindow):
         Step 3: Save paramter into a file
         Step 4: Plot the spectrum of a choosen ion species
         Step 5: Save the spectrum in as CSV file for later analysis
+        Optional: Load a field map to include fringe fields in the trajectory
+        Optional: Load a detector response to get the spectrum in particles/MeV/sr
         """)
 
     def about(self):